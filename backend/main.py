@@ -3,18 +3,25 @@ Earthquake Aftershock Monitor - FastAPI Backend
 Main API server for serving predictions and earthquake data
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta, timezone
-import json
-import pickle
+import orjson
+import hashlib
 from pathlib import Path
+from urllib.parse import urlencode
 import logging
-import requests
+import time
+import asyncio
+import httpx
+from bisect import bisect_left, bisect_right
 from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import os
 
@@ -25,7 +32,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Aftershock Monitor API",
     description="Earthquake aftershock probability prediction API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS configuration
@@ -40,6 +48,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger JSON bodies (model coverage and details, earthquake lists)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -48,6 +59,11 @@ class Config:
     MODELS_DIR = Path(os.getenv("MODELS_DIR", "../models/regional_models"))
     USGS_API_URL = os.getenv("USGS_API_URL", "https://earthquake.usgs.gov/fdsnws/event/1/query")
     CACHE_DURATION = int(os.getenv("CACHE_DURATION", "300"))  # seconds
+    MODEL_LOAD_WORKERS = int(os.getenv("MODEL_LOAD_WORKERS", "16"))
+    MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "128"))  # full models kept in memory
+    EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "8"))  # threads for blocking calls
+    NEAREST_REGION_MAX_KM = float(os.getenv("NEAREST_REGION_MAX_KM", "400"))  # 0 disables
+    EARTH_RADIUS_KM = 6371.0
     
 Config.MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -73,57 +89,301 @@ class EarthquakeEvent(BaseModel):
     url: str
     detail_url: str
 
+# ============================================================================
+# RISK SCORING TABLES
+# ============================================================================
+
+# Mainshock magnitude band edges (M >= edge), and (points, factor) per band
+_MAINSHOCK_EDGES = (5.0, 6.0, 7.0)
+_MAINSHOCK_RISK = (
+    (0, None),
+    (15, "Moderate mainshock (M≥5.0)"),
+    (25, "Large mainshock (M≥6.0)"),
+    (40, "Very large mainshock (M≥7.0)"),
+)
+
+# Day-1 rate band edges (rate > edge), and (points, factor) per band
+_AFTERSHOCK_RATE_EDGES = (5, 20, 50)
+_AFTERSHOCK_RATE_RISK = (
+    (0, None),
+    (10, "Moderate aftershock rate expected"),
+    (20, "High aftershock rate expected"),
+    (30, "Very high aftershock rate expected"),
+)
+
+# (probability to exceed, points, factor) for M5.0 and M6.0 aftershocks
+_STRONG_AFTERSHOCK_RISK = (
+    (0.5, 20, "High probability of M≥5.0 aftershocks"),
+    (0.2, 10, "Significant probability of M≥6.0 aftershocks"),
+)
+
+# Risk score band edges (score >= edge), and
+# (level, color, description, recommendations) per band
+_RISK_LEVEL_EDGES = (30, 50, 70)
+_RISK_LEVELS = (
+    ("MODERATE", "#10b981", "Moderate aftershock activity expected", (
+        "Be aware of aftershock possibility",
+        "Check for any minor damage",
+        "Keep emergency contacts handy",
+        "Follow standard earthquake safety",
+        "Monitor for updates"
+    )),
+    ("ELEVATED", "#fbbf24", "Elevated risk of aftershocks", (
+        "Stay alert for aftershocks",
+        "Inspect buildings for damage",
+        "Prepare emergency supplies",
+        "Stay informed via local authorities",
+        "Plan safe locations in your area"
+    )),
+    ("HIGH", "#f59e0b", "High risk of significant aftershocks", (
+        "Avoid damaged or weakened structures",
+        "Keep emergency kit prepared",
+        "Monitor official updates frequently",
+        "Have evacuation plan ready",
+        "Check on vulnerable neighbors"
+    )),
+    ("CRITICAL", "#dc2626", "Extremely high risk of damaging aftershocks", (
+        "Evacuate damaged buildings immediately",
+        "Prepare for multiple strong aftershocks",
+        "Keep emergency supplies readily accessible",
+        "Follow official evacuation orders",
+        "Stay away from damaged infrastructure"
+    )),
+)
+
 # ============================================================================
 # MODEL QUERY SYSTEM
 # ============================================================================
 
+# Fields kept in memory for every region; the rest is loaded on demand
+MODEL_SUMMARY_KEYS = (
+    'region_id', 'bounds', 'center', 'tectonic_setting', 'data_quality',
+    'n_sequences', 'n_total_aftershocks', 'omori_r_squared', 'gr_r_squared'
+)
+
+# Bump when the layout of the model index cache changes
+MODEL_CACHE_VERSION = 2
+
 class AftershockModelQuery:
     """Query system for loading and using trained models"""
     
     def __init__(self, models_dir: Path):
         self.models_dir = Path(models_dir)
-        self.regional_models: Dict[str, Any] = {}
+        self.model_index: Dict[str, Dict] = {}
         self.global_model: Optional[Any] = None
         self.grid_size = 5.0
+        self._model_files: Dict[str, str] = {}
+        self._cell_index: Dict[tuple[int, int], List[str]] = defaultdict(list)
+        self._center_ids: List[str] = []
+        self._center_vecs: Optional[np.ndarray] = None
+        self.get_regional_model = lru_cache(maxsize=Config.MODEL_CACHE_SIZE)(
+            self._load_regional_model
+        )
         self._load_all_models()
+        self._build_center_vectors()
+        self.coverage_body = self._build_coverage_body()
+        self._model_info = {
+            summary['region_id']: self._build_model_info(summary)
+            for summary in [*self.model_index.values(), self.global_model or {}]
+            if 'region_id' in summary
+        }
     
     def _load_all_models(self):
-        """Load all available models"""
+        """Index all available models; full regional models load lazily"""
         logger.info(f"Loading models from {self.models_dir}")
         
         # Load regional models
         json_files = list(self.models_dir.glob("region_*.json"))
+        global_path = self.models_dir / "global_fallback.json"
         logger.info(f"Found {len(json_files)} regional model files")
         
-        for json_path in json_files:
+        # Reuse the index from a previous start if no file changed
+        cache_path = self.models_dir / f".cache_{self._cache_key(json_files, global_path)}.json"
+        if self._load_cache(cache_path):
+            for region_id, summary in self.model_index.items():
+                self._index_region(region_id, summary['bounds'])
+            logger.info(f"Indexed {len(self.model_index)} regional models from {cache_path.name}")
+            return
+        
+        # Read and parse files concurrently; the index is built on this thread
+        with ThreadPoolExecutor(max_workers=Config.MODEL_LOAD_WORKERS) as executor:
+            loaded = list(executor.map(self._read_model_summary, json_files))
+        
+        for json_path, summary in zip(json_files, loaded):
+            if summary is None:
+                continue
             try:
-                with open(json_path, 'r') as f:
-                    model_data = json.load(f)
-                    region_id = model_data['region_id']
-                    self.regional_models[region_id] = model_data
+                region_id = summary['region_id']
+                self.model_index[region_id] = summary
+                self._model_files[region_id] = json_path.name
+                self._index_region(region_id, summary['bounds'])
             except Exception as e:
                 logger.error(f"Error loading {json_path}: {e}")
         
         # Load global fallback model
-        global_path = self.models_dir / "global_fallback.json"
         if global_path.exists():
             try:
-                with open(global_path, 'r') as f:
-                    self.global_model = json.load(f)
-                    logger.info("Global fallback model loaded")
+                self.global_model = orjson.loads(global_path.read_bytes())
+                logger.info("Global fallback model loaded")
             except Exception as e:
                 logger.error(f"Error loading global model: {e}")
         
-        logger.info(f"Loaded {len(self.regional_models)} regional models")
+        logger.info(f"Indexed {len(self.model_index)} regional models")
+        self._write_cache(cache_path)
+    
+    @staticmethod
+    def _cache_key(json_files: List[Path], global_path: Path) -> str:
+        """Cache key from the format version and each file's name, size and mtime"""
+        digest = hashlib.sha256(f"v{MODEL_CACHE_VERSION}".encode())
+        
+        # Files are hashed in load order, which decides ties on shared edges
+        for path in [*json_files, global_path]:
+            if path.exists():
+                stat = path.stat()
+                digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()[:16]
+    
+    def _load_cache(self, cache_path: Path) -> bool:
+        """Restore the model index from a JSON cache, if one exists"""
+        if not cache_path.exists():
+            return False
+        try:
+            cached = orjson.loads(cache_path.read_bytes())
+            self.model_index = cached['model_index']
+            self._model_files = cached['model_files']
+            self.global_model = cached['global_model']
+            return True
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable model cache {cache_path}: {e}")
+            self.model_index, self._model_files, self.global_model = {}, {}, None
+            return False
+    
+    def _write_cache(self, cache_path: Path):
+        """Write the model index cache and drop caches for older model files"""
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp_path.write_bytes(orjson.dumps({
+                'model_index': self.model_index,
+                'model_files': self._model_files,
+                'global_model': self.global_model
+            }))
+            os.replace(tmp_path, cache_path)
+            for stale in self.models_dir.glob(".cache_*"):
+                if stale != cache_path and stale.suffix in (".json", ".pkl"):
+                    stale.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not write model cache {cache_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+    
+    @staticmethod
+    def _read_model_summary(json_path: Path) -> Optional[Dict]:
+        """Read one model file and keep only its summary fields, logging failures"""
+        try:
+            model_data = orjson.loads(json_path.read_bytes())
+            return {key: model_data[key] for key in MODEL_SUMMARY_KEYS if key in model_data}
+        except Exception as e:
+            logger.error(f"Error loading {json_path}: {e}")
+            return None
+    
+    def _load_regional_model(self, region_id: str) -> Dict:
+        """Read a full regional model from disk (memoized as get_regional_model)"""
+        return orjson.loads((self.models_dir / self._model_files[region_id]).read_bytes())
+    
+    def _grid_cell(self, lat: float, lon: float) -> tuple[int, int]:
+        """Grid cell indices for a location"""
+        return (int((lat + 85) // self.grid_size),
+                int((lon + 180) // self.grid_size))
+    
+    def _index_region(self, region_id: str, bounds: Dict):
+        """Register a region under every grid cell its bounds touch"""
+        lat_min, lon_min = self._grid_cell(bounds['lat'][0], bounds['lon'][0])
+        lat_max, lon_max = self._grid_cell(bounds['lat'][1], bounds['lon'][1])
+        
+        # Upper edges are inclusive, so a region also lands in the cells
+        # just above/right of it; the bounds check below resolves those.
+        for lat_idx in range(lat_min, lat_max + 1):
+            for lon_idx in range(lon_min, lon_max + 1):
+                self._cell_index[(lat_idx, lon_idx)].append(region_id)
+    
+    @staticmethod
+    def _unit_vectors(lat, lon) -> np.ndarray:
+        """Convert lat/lon degrees to 3D unit vectors"""
+        lat = np.radians(lat)
+        lon = np.radians(lon)
+        return np.stack([
+            np.cos(lat) * np.cos(lon),
+            np.cos(lat) * np.sin(lon),
+            np.sin(lat)
+        ], axis=-1)
+    
+    def _build_center_vectors(self):
+        """Stack region centers as unit vectors for nearest-region queries"""
+        if not self.model_index:
+            return
+        
+        self._center_ids = list(self.model_index.keys())
+        centers = np.array([
+            (summary['center']['lat'], summary['center']['lon'])
+            for summary in self.model_index.values()
+        ])
+        
+        self._center_vecs = self._unit_vectors(centers[:, 0], centers[:, 1])
+    
+    def _build_coverage_body(self) -> bytes:
+        """Serialize the /api/models/coverage response, which never changes after load"""
+        coverage = [
+            {
+                'region_id': region_id,
+                'center': summary['center'],
+                'bounds': summary['bounds'],
+                'quality': summary.get('data_quality', 'unknown'),
+                'sequences': summary.get('n_sequences', 0),
+                'aftershocks': summary.get('n_total_aftershocks', 0),
+                'tectonic_setting': summary.get('tectonic_setting', 'unknown')
+            }
+            for region_id, summary in self.model_index.items()
+        ]
+        
+        return orjson.dumps({
+            "total_models": len(coverage),
+            "has_global_fallback": self.global_model is not None,
+            "coverage": coverage
+        })
+    
+    @staticmethod
+    def _build_model_info(model: Dict) -> Dict:
+        """Source-independent part of a prediction's model_info"""
+        return {
+            'region_id': model['region_id'],
+            'quality': model.get('data_quality', 'unknown'),
+            'tectonic_setting': model.get('tectonic_setting', 'unknown'),
+            'training_sequences': model.get('n_sequences', 0),
+            'training_aftershocks': model.get('n_total_aftershocks', 0),
+            'omori_r_squared': model.get('omori_r_squared', 0),
+            'gr_r_squared': model.get('gr_r_squared', 0)
+        }
+    
+    def find_nearest_region(self, lat: float, lon: float) -> Optional[str]:
+        """Find the closest region center within Config.NEAREST_REGION_MAX_KM"""
+        if self._center_vecs is None or Config.NEAREST_REGION_MAX_KM <= 0:
+            return None
+        
+        # The largest dot product is the smallest great-circle angle
+        cosines = self._center_vecs @ self._unit_vectors(lat, lon)
+        idx = int(np.argmax(cosines))
+        
+        angle = Config.NEAREST_REGION_MAX_KM / Config.EARTH_RADIUS_KM
+        if cosines[idx] < np.cos(min(angle, np.pi)):
+            return None
+        return self._center_ids[idx]
     
     def find_region_for_location(self, lat: float, lon: float) -> Optional[str]:
         """Find region ID for given location"""
-        lat_idx = int((lat + 85) // self.grid_size)
-        lon_idx = int((lon + 180) // self.grid_size)
+        candidates = self._cell_index.get(self._grid_cell(lat, lon), ())
         
-        # Search nearby regions
-        for model_id, model in self.regional_models.items():
-            bounds = model['bounds']
+        # Only regions sharing the grid cell need the bounds check
+        for model_id in candidates:
+            bounds = self.model_index[model_id]['bounds']
             if (bounds['lat'][0] <= lat <= bounds['lat'][1] and
                 bounds['lon'][0] <= lon <= bounds['lon'][1]):
                 return model_id
@@ -139,8 +399,13 @@ class AftershockModelQuery:
         
         # Try exact regional match
         region_id = self.find_region_for_location(lat, lon)
-        if region_id and region_id in self.regional_models:
-            return self.regional_models[region_id], 'regional'
+        if region_id and region_id in self.model_index:
+            return self.get_regional_model(region_id), 'regional'
+        
+        # Just outside every region: borrow the closest one nearby
+        region_id = self.find_nearest_region(lat, lon)
+        if region_id:
+            return self.get_regional_model(region_id), 'nearest_regional'
         
         # Use global fallback
         if self.global_model:
@@ -170,16 +435,7 @@ class AftershockModelQuery:
                 'latitude': lat,
                 'longitude': lon
             },
-            'model_info': {
-                'region_id': model['region_id'],
-                'source': source,
-                'quality': model.get('data_quality', 'unknown'),
-                'tectonic_setting': model.get('tectonic_setting', 'unknown'),
-                'training_sequences': model.get('n_sequences', 0),
-                'training_aftershocks': model.get('n_total_aftershocks', 0),
-                'omori_r_squared': model.get('omori_r_squared', 0),
-                'gr_r_squared': model.get('gr_r_squared', 0)
-            },
+            'model_info': {**self._model_info[model['region_id']], 'source': source},
             'forecasts': {},
             'magnitude_probabilities': {},
             'risk_assessment': {}
@@ -188,40 +444,47 @@ class AftershockModelQuery:
         # Omori predictions (temporal decay)
         p, c, K = omori['p'], omori['c'], omori['K']
         
-        for days in forecast_days:
-            rate = K / (days + c) ** p
-            
-            # Cumulative expected aftershocks
-            if p != 1:
-                cumulative = K * ((days + c)**(1-p) - c**(1-p)) / (1-p)
-            else:
-                cumulative = K * np.log((days + c)/c)
-            
+        days_arr = np.asarray(forecast_days, dtype=np.float64)
+        rates = K / (days_arr + c) ** p
+        
+        # Cumulative expected aftershocks
+        if p != 1:
+            cumulatives = K * ((days_arr + c)**(1-p) - c**(1-p)) / (1-p)
+        else:
+            cumulatives = K * np.log((days_arr + c)/c)
+        
+        # tolist() converts each array to Python floats in one call
+        for days, rate, cumulative in zip(
+            forecast_days, rates.tolist(), cumulatives.tolist()
+        ):
             predictions['forecasts'][f'day_{days}'] = {
                 'days': days,
-                'rate_per_day': float(rate),
-                'expected_aftershocks': float(rate),
-                'cumulative_expected': float(cumulative)
+                'rate_per_day': rate,
+                'expected_aftershocks': rate,
+                'cumulative_expected': cumulative
             }
         
         # G-R magnitude predictions
         b_value = gr['b_value']
         a_value = gr['a_value']
         
-        magnitude_thresholds = [3.0, 4.0, 4.5, 5.0, 5.5, 6.0, 6.5]
-        
-        for mag_threshold in magnitude_thresholds:
-            if mag_threshold < mainshock_magnitude:
-                # Expected number of aftershocks >= mag_threshold
-                N = 10 ** (a_value - b_value * mag_threshold)
-                probability = float(1 - np.exp(-N))
-                
-                predictions['magnitude_probabilities'][f'M{mag_threshold}'] = {
-                    'magnitude': mag_threshold,
-                    'expected_count': float(N),
-                    'probability': probability,
-                    'percentage': probability * 100
-                }
+        magnitude_thresholds = np.array([3.0, 4.0, 4.5, 5.0, 5.5, 6.0, 6.5])
+        mags = magnitude_thresholds[magnitude_thresholds < mainshock_magnitude]
+        
+        # Expected number of aftershocks >= each threshold
+        counts = np.power(10.0, a_value - b_value * mags)
+        probabilities = 1 - np.exp(-counts)
+        
+        for mag_threshold, N, probability, percentage in zip(
+            mags.tolist(), counts.tolist(), probabilities.tolist(),
+            (probabilities * 100).tolist()
+        ):
+            predictions['magnitude_probabilities'][f'M{mag_threshold}'] = {
+                'magnitude': mag_threshold,
+                'expected_count': N,
+                'probability': probability,
+                'percentage': percentage
+            }
         
         # Risk assessment
         predictions['risk_assessment'] = self._assess_risk(
@@ -232,94 +495,58 @@ class AftershockModelQuery:
         
         return predictions
     
-    def _assess_risk(
-        self,
+    @staticmethod
+    def _score_risk(
         mainshock_mag: float,
         day1_rate: float,
-        mag_probs: Dict
-    ) -> Dict:
-        """Assess overall risk level"""
-        
-        # Risk factors
+        p_m5: float,
+        p_m6: float
+    ) -> tuple[int, List[str]]:
+        """Score risk factors against the threshold tables"""
         risk_score = 0
         factors = []
         
         # Factor 1: Mainshock magnitude
-        if mainshock_mag >= 7.0:
-            risk_score += 40
-            factors.append("Very large mainshock (M≥7.0)")
-        elif mainshock_mag >= 6.0:
-            risk_score += 25
-            factors.append("Large mainshock (M≥6.0)")
-        elif mainshock_mag >= 5.0:
-            risk_score += 15
-            factors.append("Moderate mainshock (M≥5.0)")
+        points, factor = _MAINSHOCK_RISK[bisect_right(_MAINSHOCK_EDGES, mainshock_mag)]
+        if factor:
+            risk_score += points
+            factors.append(factor)
         
         # Factor 2: Expected aftershock rate
-        if day1_rate > 50:
-            risk_score += 30
-            factors.append("Very high aftershock rate expected")
-        elif day1_rate > 20:
-            risk_score += 20
-            factors.append("High aftershock rate expected")
-        elif day1_rate > 5:
-            risk_score += 10
-            factors.append("Moderate aftershock rate expected")
+        points, factor = _AFTERSHOCK_RATE_RISK[bisect_left(_AFTERSHOCK_RATE_EDGES, day1_rate)]
+        if factor:
+            risk_score += points
+            factors.append(factor)
         
         # Factor 3: Probability of strong aftershocks
-        if 'M5.0' in mag_probs and mag_probs['M5.0']['probability'] > 0.5:
-            risk_score += 20
-            factors.append("High probability of M≥5.0 aftershocks")
+        for probability, (min_probability, points, factor) in zip(
+            (p_m5, p_m6), _STRONG_AFTERSHOCK_RISK
+        ):
+            if probability > min_probability:
+                risk_score += points
+                factors.append(factor)
+        
+        return risk_score, factors
+    
+    def _assess_risk(
+        self,
+        mainshock_mag: float,
+        day1_rate: float,
+        mag_probs: Dict
+    ) -> Dict:
+        """Assess overall risk level"""
         
-        if 'M6.0' in mag_probs and mag_probs['M6.0']['probability'] > 0.2:
-            risk_score += 10
-            factors.append("Significant probability of M≥6.0 aftershocks")
+        risk_score, factors = self._score_risk(
+            mainshock_mag,
+            day1_rate,
+            mag_probs.get('M5.0', {}).get('probability', 0.0),
+            mag_probs.get('M6.0', {}).get('probability', 0.0)
+        )
         
         # Determine risk level
-        if risk_score >= 70:
-            level = "CRITICAL"
-            color = "#dc2626"
-            description = "Extremely high risk of damaging aftershocks"
-            recommendations = [
-                "Evacuate damaged buildings immediately",
-                "Prepare for multiple strong aftershocks",
-                "Keep emergency supplies readily accessible",
-                "Follow official evacuation orders",
-                "Stay away from damaged infrastructure"
-            ]
-        elif risk_score >= 50:
-            level = "HIGH"
-            color = "#f59e0b"
-            description = "High risk of significant aftershocks"
-            recommendations = [
-                "Avoid damaged or weakened structures",
-                "Keep emergency kit prepared",
-                "Monitor official updates frequently",
-                "Have evacuation plan ready",
-                "Check on vulnerable neighbors"
-            ]
-        elif risk_score >= 30:
-            level = "ELEVATED"
-            color = "#fbbf24"
-            description = "Elevated risk of aftershocks"
-            recommendations = [
-                "Stay alert for aftershocks",
-                "Inspect buildings for damage",
-                "Prepare emergency supplies",
-                "Stay informed via local authorities",
-                "Plan safe locations in your area"
-            ]
-        else:
-            level = "MODERATE"
-            color = "#10b981"
-            description = "Moderate aftershock activity expected"
-            recommendations = [
-                "Be aware of aftershock possibility",
-                "Check for any minor damage",
-                "Keep emergency contacts handy",
-                "Follow standard earthquake safety",
-                "Monitor for updates"
-            ]
+        level, color, description, recommendations = _RISK_LEVELS[
+            bisect_right(_RISK_LEVEL_EDGES, risk_score)
+        ]
         
         return {
             'level': level,
@@ -327,53 +554,132 @@ class AftershockModelQuery:
             'color': color,
             'description': description,
             'factors': factors,
-            'recommendations': recommendations
+            'recommendations': list(recommendations)
         }
 
 # Initialize query system
-query_system = None
+query_system: Optional[AftershockModelQuery] = None
 
-def get_query_system():
-    """Get or initialize query system"""
+@app.on_event("startup")
+async def load_query_system():
+    """Pin the blocking-call executor and load models before serving"""
     global query_system
-    if query_system is None:
-        query_system = AftershockModelQuery(Config.MODELS_DIR)
-    return query_system
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(
+        max_workers=Config.EXECUTOR_WORKERS,
+        thread_name_prefix="aftershock-io"
+    ))
+    query_system = await asyncio.to_thread(AftershockModelQuery, Config.MODELS_DIR)
 
 # ============================================================================
 # USGS DATA FETCHING
 # ============================================================================
 
-@lru_cache(maxsize=10)
-def fetch_recent_earthquakes(
+class TTLCache:
+    """Small dict cache whose entries expire after a fixed number of seconds"""
+    
+    def __init__(self, ttl: float, maxsize: int = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: Dict[Any, tuple[float, Any]] = {}
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._entries.pop(key, None)
+            return None
+        return value
+    
+    def set(self, key: Any, value: Any):
+        """Store a value, evicting the oldest entry when full"""
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.maxsize:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+# Shared client so USGS requests reuse pooled connections
+http_client: Optional[httpx.AsyncClient] = None
+
+# Query parameters that never change, encoded once
+USGS_QUERY_PREFIX = Config.USGS_API_URL + "?" + urlencode({
+    'format': 'geojson',
+    'orderby': 'time'
+}) + "&"
+
+# (days, min_magnitude) -> (etag, serialized /api/earthquakes body, expires_at)
+earthquake_cache = TTLCache(Config.CACHE_DURATION)
+
+# (days, min_magnitude) -> USGS fetch in progress, shared by concurrent misses
+earthquake_fetches: Dict[tuple, asyncio.Task] = {}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison against a list of entity tags"""
+    if not if_none_match:
+        return False
+    
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+@app.on_event("startup")
+async def open_http_client():
+    """Create the shared HTTP client"""
+    global http_client
+    http_client = httpx.AsyncClient(timeout=30)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Close the shared HTTP client"""
+    if http_client is not None:
+        await http_client.aclose()
+
+def _iso_timestamps(epoch_ms) -> List[str]:
+    """Format epoch-millisecond timestamps as naive UTC ISO-8601 strings"""
+    millis = np.fromiter(epoch_ms, dtype=np.int64).astype('datetime64[ms]')
+    return np.datetime_as_string(millis, unit='us').tolist()
+
+def _magnitude_key(earthquake: Dict) -> float:
+    """Sort key treating missing magnitudes as very small"""
+    magnitude = earthquake.get('magnitude')
+    return magnitude if magnitude is not None else -999
+
+async def fetch_recent_earthquakes(
     days: int = 7,
     min_magnitude: float = 4.0,
     max_results: int = 100
-) -> List[Dict]:
-    """Fetch recent earthquakes from USGS"""
+) -> Optional[List[Dict]]:
+    """Fetch recent earthquakes from USGS, or None if the request failed"""
     
     end_time = datetime.now(timezone.utc)
     start_time = end_time - timedelta(days=days)
     
-    params = {
-        'format': 'geojson',
+    url = USGS_QUERY_PREFIX + urlencode({
         'starttime': start_time.strftime('%Y-%m-%d'),
         'endtime': end_time.strftime('%Y-%m-%d'),
         'minmagnitude': min_magnitude,
-        'orderby': 'time',
         'limit': max_results
-    }
+    })
     
     try:
         logger.info(f"Fetching earthquakes from USGS (days={days}, min_mag={min_magnitude})")
-        response = requests.get(Config.USGS_API_URL, params=params, timeout=30)
+        response = await http_client.get(url)
         response.raise_for_status()
         
         data = response.json()
         features = data.get('features', [])
         
+        # Convert all epoch-millisecond timestamps in one NumPy pass
+        times = _iso_timestamps(feature['properties']['time'] for feature in features)
+        updated = _iso_timestamps(feature['properties']['updated'] for feature in features)
+        
         earthquakes = []
-        for feature in features:
+        for feature, time_iso, updated_iso in zip(features, times, updated):
             props = feature['properties']
             coords = feature['geometry']['coordinates']
             
@@ -383,71 +689,134 @@ def fetch_recent_earthquakes(
                 'latitude': coords[1],
                 'longitude': coords[0],
                 'depth': coords[2],
-                'time': datetime.fromtimestamp(props['time'] / 1000).isoformat(),
+                'time': time_iso,
                 'place': props['place'],
-                'updated': datetime.fromtimestamp(props['updated'] / 1000).isoformat(),
+                'updated': updated_iso,
                 'url': props['url'],
-                'detail_url': feature['properties']['detail']
+                'detail_url': props['detail']
             })
         
-        # Sort earthquakes by magnitude (descending). Treat missing magnitudes as very small so they appear last.
-        earthquakes.sort(key=lambda e: e.get('magnitude') if e.get('magnitude') is not None else -999, reverse=True)
+        # Order by magnitude (descending). Missing magnitudes sort last.
+        # USGS already caps the feed at max_results, so a full sort is cheap.
+        earthquakes.sort(key=_magnitude_key, reverse=True)
 
         logger.info(f"Fetched {len(earthquakes)} earthquakes")
         return earthquakes
         
     except Exception as e:
         logger.error(f"Error fetching earthquakes: {e}")
-        return []
+        return None
+
+async def refresh_earthquakes(
+    days: int,
+    min_magnitude: float
+) -> Optional[tuple[str, bytes, float]]:
+    """Fetch, serialize and cache one /api/earthquakes response"""
+    earthquakes = await fetch_recent_earthquakes(days, min_magnitude)
+    if earthquakes is None:
+        return None
+    
+    payload = {
+        "count": len(earthquakes),
+        "earthquakes": earthquakes,
+        "filters": {
+            "days": days,
+            "min_magnitude": min_magnitude
+        },
+        "fetched_at": datetime.now(timezone.utc).isoformat()
+    }
+    body = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    
+    cached = (
+        f'"{hashlib.md5(body).hexdigest()}"',
+        body,
+        time.monotonic() + Config.CACHE_DURATION
+    )
+    earthquake_cache.set((days, min_magnitude), cached)
+    return cached
 
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+# The root payload never changes, so serialize it once
+ROOT_RESPONSE = orjson.dumps({
+    "name": "Aftershock Monitor API",
+    "version": "1.0.0",
+    "status": "operational",
+    "endpoints": {
+        "earthquakes": "/api/earthquakes",
+        "predict": "/api/predict",
+        "models": "/api/models",
+        "health": "/api/health"
+    }
+})
+
+# Serialized health payload, refreshed at most once a second
+health_cache = TTLCache(1, maxsize=1)
+
 @app.get("/")
 async def root():
     """API root endpoint"""
-    return {
-        "name": "Aftershock Monitor API",
-        "version": "1.0.0",
-        "status": "operational",
-        "endpoints": {
-            "earthquakes": "/api/earthquakes",
-            "predict": "/api/predict",
-            "models": "/api/models",
-            "health": "/api/health"
-        }
-    }
+    return Response(ROOT_RESPONSE, media_type="application/json")
 
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    qs = get_query_system()
-    return {
-        "status": "healthy",
-        "models_loaded": len(qs.regional_models),
-        "has_global_model": qs.global_model is not None,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    body = health_cache.get("health")
+    if body is None:
+        body = orjson.dumps({
+            "status": "healthy",
+            "models_loaded": len(query_system.model_index),
+            "has_global_model": query_system.global_model is not None,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+        health_cache.set("health", body)
+    return Response(body, media_type="application/json")
 
 @app.get("/api/earthquakes")
 async def get_earthquakes(
+    request: Request,
     days: int = Query(7, ge=1, le=365, description="Number of days to fetch"),
     min_magnitude: float = Query(4.0, ge=2.5, le=10.0, description="Minimum magnitude")
 ):
     """Get recent earthquakes from USGS"""
     
     try:
-        earthquakes = fetch_recent_earthquakes(days, min_magnitude)
-        return {
-            "count": len(earthquakes),
-            "earthquakes": earthquakes,
-            "filters": {
-                "days": days,
-                "min_magnitude": min_magnitude
-            },
-            "fetched_at": datetime.now(timezone.utc).isoformat()
+        cache_key = (days, min_magnitude)
+        cached = earthquake_cache.get(cache_key)
+        
+        if cached is None:
+            # Concurrent misses for the same query share one USGS request
+            fetch = earthquake_fetches.get(cache_key)
+            if fetch is None:
+                fetch = asyncio.create_task(refresh_earthquakes(days, min_magnitude))
+                earthquake_fetches[cache_key] = fetch
+                fetch.add_done_callback(lambda _: earthquake_fetches.pop(cache_key, None))
+            cached = await asyncio.shield(fetch)
+        
+        # Failed fetches are never cached, here or downstream
+        if cached is None:
+            raise HTTPException(
+                status_code=502,
+                detail="Could not fetch earthquakes from USGS",
+                headers={"Cache-Control": "no-store"}
+            )
+        
+        # Downstream caches only get whatever lifetime this entry has left
+        etag, body, expires_at = cached
+        max_age = max(0, int(expires_at - time.monotonic()))
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={max_age}"
         }
+        
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        return Response(body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_earthquakes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -457,20 +826,20 @@ async def predict_aftershocks(request: PredictionRequest):
     """Predict aftershocks for an earthquake"""
     
     try:
-        qs = get_query_system()
-        
-        predictions = qs.predict_aftershocks(
+        # May read a regional model file on a cache miss
+        predictions = await asyncio.to_thread(
+            query_system.predict_aftershocks,
             mainshock_magnitude=request.magnitude,
             lat=request.latitude,
             lon=request.longitude,
             tectonic_setting=request.tectonic_setting
         )
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "predictions": predictions,
             "generated_at": datetime.now(timezone.utc).isoformat()
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error in predict_aftershocks: {e}")
@@ -481,25 +850,7 @@ async def get_model_coverage():
     """Get global model coverage information"""
     
     try:
-        qs = get_query_system()
-        
-        coverage = []
-        for region_id, model in qs.regional_models.items():
-            coverage.append({
-                'region_id': region_id,
-                'center': model['center'],
-                'bounds': model['bounds'],
-                'quality': model.get('data_quality', 'unknown'),
-                'sequences': model.get('n_sequences', 0),
-                'aftershocks': model.get('n_total_aftershocks', 0),
-                'tectonic_setting': model.get('tectonic_setting', 'unknown')
-            })
-        
-        return {
-            "total_models": len(coverage),
-            "has_global_fallback": qs.global_model is not None,
-            "coverage": coverage
-        }
+        return Response(query_system.coverage_body, media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error in get_model_coverage: {e}")
@@ -510,17 +861,15 @@ async def get_model_details(region_id: str):
     """Get detailed information about a specific model"""
     
     try:
-        qs = get_query_system()
-        
-        if region_id not in qs.regional_models:
+        if region_id not in query_system.model_index:
             raise HTTPException(status_code=404, detail="Model not found")
         
-        model = qs.regional_models[region_id]
+        model = await asyncio.to_thread(query_system.get_regional_model, region_id)
         
-        return {
+        return ORJSONResponse({
             "model": model,
             "retrieved_at": datetime.now(timezone.utc).isoformat()
-        }
+        })
         
     except HTTPException:
         raise
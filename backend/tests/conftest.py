@@ -0,0 +1,41 @@
+"""
+Shared fixtures for the backend tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+MODELS_SRC = BACKEND_DIR.parent / "models" / "regional_models"
+
+# Work on a copy so model cache files never land in the repository
+_models_dir = tempfile.mkdtemp(prefix="aftershock-models-")
+shutil.copytree(MODELS_SRC, _models_dir, dirs_exist_ok=True,
+                ignore=shutil.ignore_patterns(".cache_*"))
+os.environ["MODELS_DIR"] = _models_dir
+sys.path.insert(0, str(BACKEND_DIR))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_models_dir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Test client with startup handlers run (models loaded)"""
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def query_system(client):
+    """The loaded AftershockModelQuery"""
+    return main.query_system
@@ -0,0 +1,141 @@
+"""
+Tests for /api/earthquakes caching and conditional requests
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+
+FEATURES = [
+    {
+        "id": f"us{i}",
+        "properties": {
+            "mag": 4.0 + i / 10,
+            "place": f"Place {i}",
+            "time": 1700000000000 + i * 60000,
+            "updated": 1700000500000 + i,
+            "url": f"https://example.org/us{i}",
+            "detail": f"https://example.org/us{i}.geojson"
+        },
+        "geometry": {"coordinates": [140.0 + i, 35.0, 10.0]}
+    }
+    for i in range(5)
+]
+
+
+@pytest.fixture
+def usgs(client, monkeypatch):
+    """Route USGS requests to a mock and record them"""
+    state = {"status": 200, "calls": 0, "features": FEATURES, "delay": 0}
+    
+    async def handler(request):
+        state["calls"] += 1
+        await asyncio.sleep(state["delay"])
+        if state["status"] != 200:
+            return httpx.Response(state["status"])
+        return httpx.Response(200, json={"features": state["features"]})
+    
+    monkeypatch.setattr(main, "http_client",
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(main, "earthquake_cache", main.TTLCache(main.Config.CACHE_DURATION))
+    monkeypatch.setattr(main, "earthquake_fetches", {})
+    return state
+
+
+def test_response_is_cached_with_etag(client, usgs):
+    first = client.get("/api/earthquakes")
+    second = client.get("/api/earthquakes")
+    
+    assert first.status_code == 200
+    assert first.json()["count"] == len(FEATURES)
+    assert first.headers["etag"]
+    max_age = int(first.headers["cache-control"].removeprefix("public, max-age="))
+    assert main.Config.CACHE_DURATION - 1 <= max_age <= main.Config.CACHE_DURATION
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+    assert usgs["calls"] == 1
+
+
+def test_cached_max_age_is_remaining_lifetime(client, usgs):
+    body = b'{"count": 0}'
+    main.earthquake_cache.set((7, 4.0), ('"seeded"', body, time.monotonic() + 42))
+    
+    response = client.get("/api/earthquakes")
+    
+    assert response.content == body
+    assert response.headers["cache-control"] in ("public, max-age=41", "public, max-age=42")
+    assert usgs["calls"] == 0
+
+
+def test_concurrent_misses_share_one_fetch(client, usgs):
+    usgs["delay"] = 0.1
+    
+    async def fetch_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get("/api/earthquakes") for _ in range(5)))
+    
+    responses = asyncio.run(fetch_all())
+    
+    assert [r.status_code for r in responses] == [200] * 5
+    assert len({r.content for r in responses}) == 1
+    assert usgs["calls"] == 1
+    assert main.earthquake_fetches == {}
+
+
+@pytest.mark.parametrize("if_none_match", [
+    "{etag}",
+    "W/{etag}",
+    '"other", {etag}',
+    "*",
+])
+def test_matching_if_none_match_returns_304(client, usgs, if_none_match):
+    etag = client.get("/api/earthquakes").headers["etag"]
+    
+    response = client.get("/api/earthquakes",
+                          headers={"If-None-Match": if_none_match.format(etag=etag)})
+    
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_stale_if_none_match_returns_body(client, usgs):
+    response = client.get("/api/earthquakes", headers={"If-None-Match": '"stale"'})
+    
+    assert response.status_code == 200
+    assert response.json()["count"] == len(FEATURES)
+
+
+def test_failed_fetch_is_not_cached(client, usgs):
+    usgs["status"] = 503
+    
+    failed = client.get("/api/earthquakes")
+    
+    assert failed.status_code == 502
+    assert failed.headers["cache-control"] == "no-store"
+    assert "etag" not in failed.headers
+    
+    usgs["status"] = 200
+    recovered = client.get("/api/earthquakes")
+    
+    assert recovered.json()["count"] == len(FEATURES)
+    assert usgs["calls"] == 2
+
+
+def test_empty_feed_is_cached(client, usgs):
+    usgs["features"] = []
+    
+    first = client.get("/api/earthquakes", params={"days": 1, "min_magnitude": 7})
+    second = client.get("/api/earthquakes", params={"days": 1, "min_magnitude": 7})
+    
+    assert first.status_code == 200
+    assert first.json()["count"] == 0
+    assert first.headers["etag"]
+    assert first.headers["cache-control"].startswith("public, max-age=")
+    assert second.content == first.content
+    assert usgs["calls"] == 1
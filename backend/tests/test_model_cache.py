@@ -0,0 +1,52 @@
+"""
+Tests for the on-disk model index cache
+"""
+
+import shutil
+
+import main
+
+
+def _copy_models(tmp_path):
+    models_dir = tmp_path / "models"
+    shutil.copytree(main.Config.MODELS_DIR, models_dir,
+                    ignore=shutil.ignore_patterns(".cache_*"))
+    return models_dir
+
+
+def test_cache_restores_same_index(tmp_path):
+    models_dir = _copy_models(tmp_path)
+    
+    fresh = main.AftershockModelQuery(models_dir)
+    cache_files = list(models_dir.glob(".cache_*.json"))
+    cached = main.AftershockModelQuery(models_dir)
+    
+    assert len(cache_files) == 1
+    assert list(cached.model_index) == list(fresh.model_index)
+    assert cached.model_index == fresh.model_index
+    assert cached.global_model == fresh.global_model
+    assert cached.coverage_body == fresh.coverage_body
+
+
+def test_changed_model_file_invalidates_cache(tmp_path):
+    models_dir = _copy_models(tmp_path)
+    main.AftershockModelQuery(models_dir)
+    old_cache = next(models_dir.glob(".cache_*.json"))
+    
+    model_path = models_dir / "region_0274.json"
+    model_path.write_text(model_path.read_text().replace('"low"', '"high"'))
+    query = main.AftershockModelQuery(models_dir)
+    
+    assert query.model_index["region_0274"]["data_quality"] == "high"
+    assert not old_cache.exists()
+    assert len(list(models_dir.glob(".cache_*.json"))) == 1
+
+
+def test_unreadable_cache_falls_back_to_model_files(tmp_path):
+    models_dir = _copy_models(tmp_path)
+    main.AftershockModelQuery(models_dir)
+    next(models_dir.glob(".cache_*.json")).write_bytes(b"not json")
+    
+    query = main.AftershockModelQuery(models_dir)
+    
+    assert len(query.model_index) == len(list(models_dir.glob("region_*.json")))
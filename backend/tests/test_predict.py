@@ -0,0 +1,24 @@
+"""
+Tests for /api/predict
+"""
+
+
+def test_predict_serializes_numbers_as_floats(client):
+    response = client.post("/api/predict", json={
+        "magnitude": 7.1,
+        "latitude": 35.5,
+        "longitude": 139.2
+    })
+    assert response.status_code == 200
+    
+    predictions = response.json()["predictions"]
+    assert predictions["forecasts"]
+    assert predictions["magnitude_probabilities"]
+    
+    for forecast in predictions["forecasts"].values():
+        assert type(forecast["rate_per_day"]) is float
+        assert type(forecast["cumulative_expected"]) is float
+    
+    for probability in predictions["magnitude_probabilities"].values():
+        assert type(probability["probability"]) is float
+        assert type(probability["expected_count"]) is float
@@ -0,0 +1,101 @@
+"""
+Tests for regional model lookup and the nearest-region fallback
+"""
+
+import math
+import random
+
+import main
+
+
+def _great_circle_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * main.Config.EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def test_point_just_outside_region_uses_nearest_regional(query_system):
+    # East of region_0274 (lon 110-115), in a cell with no model
+    assert query_system.find_region_for_location(-67.5, 116.0) is None
+    
+    model, source = query_system.get_model_for_earthquake(-67.5, 116.0)
+    
+    assert source == 'nearest_regional'
+    assert model['region_id'] == 'region_0274'
+
+
+def test_remote_point_uses_global_fallback(query_system):
+    model, source = query_system.get_model_for_earthquake(0.0, -150.0)
+    
+    assert source == 'global_fallback'
+    assert model['region_id'] == 'global_fallback'
+
+
+def test_nearest_region_can_be_disabled(query_system, monkeypatch):
+    monkeypatch.setattr(main.Config, "NEAREST_REGION_MAX_KM", 0)
+    
+    _, source = query_system.get_model_for_earthquake(-67.5, 116.0)
+    
+    assert source == 'global_fallback'
+
+
+def test_nearest_region_matches_great_circle_search(query_system):
+    rng = random.Random(0)
+    max_km = main.Config.NEAREST_REGION_MAX_KM
+    
+    for _ in range(500):
+        lat, lon = rng.uniform(-85, 85), rng.uniform(-180, 180)
+        distances = {
+            region_id: _great_circle_km(lat, lon, summary['center']['lat'], summary['center']['lon'])
+            for region_id, summary in query_system.model_index.items()
+        }
+        best = min(distances, key=distances.get)
+        
+        # Skip points sitting on the radius where rounding could go either way
+        if abs(distances[best] - max_km) < 1:
+            continue
+        
+        expected = best if distances[best] <= max_km else None
+        assert query_system.find_nearest_region(lat, lon) == expected
+
+
+def _linear_scan(query_system, lat, lon):
+    """The original lookup: first region in load order whose bounds contain the point"""
+    for region_id, summary in query_system.model_index.items():
+        bounds = summary['bounds']
+        if (bounds['lat'][0] <= lat <= bounds['lat'][1] and
+                bounds['lon'][0] <= lon <= bounds['lon'][1]):
+            return region_id
+    return None
+
+
+def test_grid_lookup_matches_linear_scan_on_shared_edges(query_system):
+    rng = random.Random(0)
+    points = [(lat, lon) for lat in range(-90, 91, 5) for lon in range(-180, 181, 5)]
+    points += [(rng.randint(-18, 18) * 5.0, rng.uniform(-180, 180)) for _ in range(2000)]
+    points += [(rng.uniform(-90, 90), rng.randint(-36, 36) * 5.0) for _ in range(2000)]
+    
+    shared = 0
+    for lat, lon in points:
+        expected = _linear_scan(query_system, lat, lon)
+        assert query_system.find_region_for_location(lat, lon) == expected
+        
+        if expected is not None:
+            containing = [
+                region_id for region_id, summary in query_system.model_index.items()
+                if summary['bounds']['lat'][0] <= lat <= summary['bounds']['lat'][1]
+                and summary['bounds']['lon'][0] <= lon <= summary['bounds']['lon'][1]
+            ]
+            shared += len(containing) > 1
+    
+    # Make sure the sample actually exercised points owned by several regions
+    assert shared > 0
+
+
+def test_grid_lookup_matches_linear_scan_inside_regions(query_system):
+    rng = random.Random(1)
+    
+    for _ in range(5000):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        assert query_system.find_region_for_location(lat, lon) == _linear_scan(query_system, lat, lon)